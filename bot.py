@@ -33,6 +33,8 @@ class MN_Bot(Client):
             bot_token=BOT.TOKEN,
             plugins=dict(root="plugins"),
             workers=16,
+            # Let several video downloads/uploads run at once instead of queueing behind one another
+            max_concurrent_transmissions=4,
         )
 
     async def start(self):
@@ -43,7 +45,7 @@ class MN_Bot(Client):
         self.username = me.username
         await self.send_message(chat_id=OWNER.ID,
                                 text=f"{me.first_name} ✅✅ BOT started successfully ✅✅")
-        logging.info(f"✅ {me.first_name} BOT started successfully")
+        logging.info("✅ %s BOT started successfully", me.first_name)
 
     async def stop(self, *args):
         await super().stop()
@@ -16,3 +16,8 @@ class OWNER:
 class WEB:
     PORT = int(os.environ.get("PORT", 8000))
 
+class FFMPEG:
+    PRESET = os.environ.get("X264_PRESET", "faster")
+    MAX_JOBS = int(os.environ.get("FFMPEG_MAX_JOBS", 0))
+    SCRATCH_DIR = os.environ.get("WM_SCRATCH", "")
+    GPU_OVERLAY = int(os.environ.get("FFMPEG_GPU_OVERLAY", 0))
@@ -1,9 +1,22 @@
 import os
 import asyncio
-import urllib.request
+import functools
+import hashlib
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+import aiohttp
+import aiofiles
+import aiofiles.os
 from pyrogram import Client, filters
+from pyrogram.errors import MessageNotModified
 import ffmpeg
 import logging
+from PIL import Image, ImageDraw, ImageFont
+from config import FFMPEG
 
 # Set up logging for this module
 logger = logging.getLogger(__name__)
@@ -14,28 +27,638 @@ DEFAULT_IMAGE_WATERMARK_URL = "https://i.ibb.co/xW7NS5d/image.jpg"
 # Default text watermark (Your provided text)
 DEFAULT_TEXT_WATERMARK = "join @mnbots in telegram"
 
-# Path for the downloaded default image watermark
-DEFAULT_IMAGE_WATERMARK_PATH = "./downloads/default_watermark_image.png"
+# Fonts to draw the text watermark with, in order of preference
+POSSIBLE_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/Library/Fonts/Arial.ttf",
+]
+# Resolved once at import; None means the text watermark is skipped
+_FONT_PATH = next((p for p in POSSIBLE_FONTS if os.path.exists(p)), None)
+# Font size is ~3% of the video height, rounded up to a multiple of the step so rendered PNGs get reused
+TEXT_WATERMARK_FONT_SIZE = 24  # Used when the video height is unknown
+TEXT_WATERMARK_MIN_FONT_SIZE = 18
+TEXT_WATERMARK_FONT_SCALE = 0.03
+TEXT_WATERMARK_FONT_SIZE_STEP = 4
+TEXT_WATERMARK_OPACITY = 0.8
+# Written into the container metadata of every video this bot produces, to recognise them if they come back
+WATERMARK_SENTINEL = "mnbots_watermarked_v1"
+# Our faststart output keeps the moov atom (and so the sentinel) at the front. A piped input's
+# moov is buffered up to this size to look for it; longer videos have bigger sample tables.
+MOOV_PEEK_MAX_SIZE = 16 * 1024 * 1024
+# Videos shorter than this (in pixels) are too small for the watermarks and are only remuxed
+MIN_WATERMARK_VIDEO_HEIGHT = 60
 
-# Ensure downloads directory exists
-os.makedirs("./downloads", exist_ok=True)
+# Downloads, rendered watermarks and encoded output go to WM_SCRATCH when it is set, e.g.
+# /dev/shm/mnbots to keep that I/O off the container's overlay filesystem. It is opt-in: tmpfs
+# pages count against the container's memory limit, so only point it at tmpfs on hosts with
+# memory to spare for a few videos.
+DISK_DOWNLOAD_DIR = "./downloads"
+DOWNLOAD_DIR = FFMPEG.SCRATCH_DIR or DISK_DOWNLOAD_DIR
+
+# Ensure downloads directories exist (disk is kept as the overflow for videos too big for tmpfs)
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+os.makedirs(DISK_DOWNLOAD_DIR, exist_ok=True)
+
+# Path for the downloaded default image watermark (original, as fetched)
+DEFAULT_IMAGE_WATERMARK_SOURCE_PATH = os.path.join(DOWNLOAD_DIR, "default_watermark_source.jpg")
+# Path for the pre-rendered watermark (scaled, RGBA with opacity baked in)
+DEFAULT_IMAGE_WATERMARK_PATH = os.path.join(DOWNLOAD_DIR, "default_watermark_rgba.png")
+# Width the image watermark is pre-rendered at, used when the video width is unknown
+DEFAULT_IMAGE_WATERMARK_WIDTH = 256
+# Otherwise the watermark is ~10% of the video width. Widths are bucketed to the nearest
+# step so only a handful of sizes are ever rendered.
+IMAGE_WATERMARK_WIDTH_RATIO = 0.1
+IMAGE_WATERMARK_MIN_WIDTH = 48
+IMAGE_WATERMARK_WIDTH_BUCKET = 128
+# Opacity baked into the pre-rendered image watermark
+DEFAULT_IMAGE_WATERMARK_OPACITY = 0.7
+
+# Concurrent encodes are capped at roughly one per 4 cores so they don't oversubscribe the CPU.
+# FFMPEG_MAX_JOBS overrides the cap, e.g. when hardware encoding leaves the CPU mostly idle.
+_CPU_COUNT = os.cpu_count() or 4
+FFMPEG_MAX_JOBS = FFMPEG.MAX_JOBS or max(1, _CPU_COUNT // 4)
+# Cores are split evenly between the job slots, for the encoder and the filter graph alike;
+# a lone job slot gets every core instead of a fixed handful.
+FFMPEG_THREADS_PER_JOB = max(1, _CPU_COUNT // FFMPEG_MAX_JOBS)
+_ENCODE_SEM = asyncio.Semaphore(FFMPEG_MAX_JOBS)
+
+# H.264 encoders in order of preference; hardware encoders are used when they actually work here
+VIDEO_ENCODER_PREFERENCE = ['h264_nvenc', 'h264_vaapi', 'h264_qsv', 'h264_videotoolbox', 'h264_v4l2m2m', 'libx264']
+# Render node used by the VAAPI encoder
+VAAPI_DEVICE = "/dev/dri/renderD128"
+# Encoder-specific output options (speed preset, rate control and pixel format)
+VIDEO_ENCODER_OPTIONS = {
+    # Constant-quality VBR; b:v 0 lets cq alone drive the bitrate, like CRF does for x264
+    'h264_nvenc': {'preset': 'p4', 'rc': 'vbr', 'cq': 26, 'b:v': 0, 'pix_fmt': 'yuv420p'},
+    'h264_vaapi': {},  # Frames are uploaded to the GPU by the filter graph
+    'h264_qsv': {'preset': 'veryfast', 'pix_fmt': 'nv12'},
+    'h264_videotoolbox': {'realtime': 1, 'pix_fmt': 'yuv420p'},
+    # The V4L2 M2M encoder (e.g. Raspberry Pi) has no quality mode and a very low default bitrate
+    'h264_v4l2m2m': {'b:v': '4M', 'pix_fmt': 'yuv420p'},
+    # fastdecode keeps playback light on the low-power phones most Telegram users watch on.
+    # x264-params trims motion search and lookahead whose last few percent of compression
+    # buys nothing for a burned-in logo over user video; CRF 25 keeps quality comparable.
+    'libx264': {
+        'preset': FFMPEG.PRESET,
+        'crf': 25,
+        'tune': 'fastdecode',
+        'x264-params': 'bframes=1:ref=1:subme=4:rc-lookahead=10:aq-mode=0',
+        'pix_fmt': 'yuv420p',
+    },
+}
+# Input options that move decoding onto the same hardware as the encoder. Decoded frames
+# are copied back to system memory for the CPU overlays, and unsupported codecs fall back
+# to software decoding.
+VIDEO_DECODER_OPTIONS = {
+    'h264_nvenc': {'hwaccel': 'cuda'},
+}
+
+# Whether the default image watermark is on disk; only updated when preparing it succeeds or fails
+_WM_AVAILABLE = False
+# Pre-scaled image watermarks, keyed on width bucket; values are tasks resolving to the PNG path
+_WM_CACHE: dict[int, asyncio.Future] = {}
+# Pre-rendered text watermarks, keyed on (text, fontsize); values are tasks resolving to the PNG path
+_TEXT_WM_CACHE: dict[tuple[str, int], asyncio.Future] = {}
+
+# Progress edits closer together than this (in seconds) are coalesced, sending only the latest
+# once the interval is up; final states always go through immediately
+STATUS_EDIT_INTERVAL = 0.5
+# Last (text, time) sent to each status message, keyed on (chat_id, message_id)
+_status_edits = {}
+# Deferred edits waiting out STATUS_EDIT_INTERVAL, keyed like _status_edits; values are (text, task)
+_status_pending = {}
+
+# Move the moov atom to the front once the encode finishes, so Telegram can stream the upload
+MP4_MOVFLAGS = '+faststart'
+
+# Already-watermarked uploads, keyed on (source file_unique_id, watermark text). Values are
+# (file_id, caption) of our upload, so a repeat of the same clip is answered without re-encoding.
+_OUTPUT_CACHE_SIZE = 1024
+_output_cache = OrderedDict()
+# file_unique_ids of our own uploads, so videos sent back to the bot aren't watermarked twice
+_produced_ids = OrderedDict()
+
+# Probed (duration, width, height, comment) per source video, keyed on (file_unique_id, file_size)
+_PROBE_CACHE_SIZE = 512
+_probe_cache = OrderedDict()
+
+# Shared HTTP session, created lazily inside the running event loop
+_AIOHTTP_SESSION = None
+# Single in-flight download of the default watermark, shared by all waiting handlers
+_default_wm_future: asyncio.Future | None = None
+_default_wm_lock = asyncio.Lock()
+
+
+def _encoder_works(encoder):
+    """
+    Runs a tiny trial encode, since ffmpeg lists hardware encoders even when
+    no matching device or driver is present.
+    """
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error']
+    if encoder == 'h264_vaapi':
+        cmd += ['-vaapi_device', VAAPI_DEVICE]
+    cmd += ['-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1']
+    if encoder == 'h264_vaapi':
+        cmd += ['-vf', 'format=nv12,hwupload']
+    cmd += ['-c:v', encoder, '-f', 'null', '-']
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=15).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+def _detect_video_encoder():
+    """
+    Picks the first working encoder from VIDEO_ENCODER_PREFERENCE, falling back to libx264.
+    """
+    try:
+        listing = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                 capture_output=True, text=True, timeout=15).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning("Could not list ffmpeg encoders, using libx264. Error: %s", e)
+        return 'libx264'
+
+    for encoder in VIDEO_ENCODER_PREFERENCE[:-1]:
+        if f" {encoder} " in listing and _encoder_works(encoder):
+            return encoder
+    return 'libx264'
+
+# Probed once at startup
+_VCODEC = _detect_video_encoder()
+logger.info("Using video encoder: %s", _VCODEC)
+
+# Everything about the ffmpeg invocation that doesn't depend on the video, resolved once here
+_DECODER_ARGS = VIDEO_DECODER_OPTIONS.get(_VCODEC, {})
+# Mapping the first audio track as optional ('?') keeps silent videos working without probing for audio;
+# a bigger muxing queue avoids stalls when the filtered video lags behind the copied audio.
+_AUDIO_MAP = '0:a:0?'
+_MAX_MUXING_QUEUE_SIZE = 1024
+# Nothing to burn in: copy both streams into an MP4. No sentinel, since the video isn't watermarked.
+_REMUX_OUTPUT_ARGS = {
+    'format': 'mp4',
+    'map': _AUDIO_MAP,
+    'max_muxing_queue_size': _MAX_MUXING_QUEUE_SIZE,
+    'vcodec': 'copy',
+    'acodec': 'copy',
+    'movflags': MP4_MOVFLAGS,
+}
+_ENCODE_OUTPUT_ARGS = {
+    'format': 'mp4',
+    'map': _AUDIO_MAP,      # Original audio track, if there is one
+    'max_muxing_queue_size': _MAX_MUXING_QUEUE_SIZE,
+    'vcodec': _VCODEC,      # Video codec for re-encoding (hardware encoder when available)
+    'acodec': 'copy',       # Copy audio codec (no re-encoding)
+    'threads': FFMPEG_THREADS_PER_JOB, # Cap per-job threads so parallel encodes share cores fairly
+    'movflags': MP4_MOVFLAGS, # Index at the front, so the upload plays while it streams
+    'metadata': f'comment={WATERMARK_SENTINEL}', # Marks the output as already processed by this bot
+    **VIDEO_ENCODER_OPTIONS[_VCODEC], # Preset, rate control and pixel format for the chosen encoder
+}
+# Both overlays compile into one -filter_complex graph; let it use the job's thread budget
+_ENCODE_GLOBAL_ARGS = [
+    '-filter_threads', str(FFMPEG_THREADS_PER_JOB),
+    '-filter_complex_threads', str(FFMPEG_THREADS_PER_JOB),
+]
+if _VCODEC == 'h264_vaapi':
+    _ENCODE_GLOBAL_ARGS += ['-vaapi_device', VAAPI_DEVICE]
+
+# With NVENC, frames can stay in GPU memory from decode to encode: the watermarks are uploaded
+# once and composited with overlay_cuda, so no frame crosses PCIe. Decoder, uploads and
+# overlay all share one named CUDA device. Opt-in with FFMPEG_GPU_OVERLAY=1 until this graph
+# has been proven on NVENC hardware; a failing run costs a full CPU re-encode.
+_GPU_OVERLAY = _VCODEC == 'h264_nvenc' and bool(FFMPEG.GPU_OVERLAY)
+_GPU_DECODER_ARGS = {'hwaccel': 'cuda', 'hwaccel_device': 'gpu', 'hwaccel_output_format': 'cuda'}
+_GPU_ENCODE_OUTPUT_ARGS = {k: v for k, v in _ENCODE_OUTPUT_ARGS.items() if k != 'pix_fmt'}  # Frames are already yuv420p on the GPU
+_GPU_ENCODE_GLOBAL_ARGS = _ENCODE_GLOBAL_ARGS + ['-init_hw_device', 'cuda=gpu', '-filter_hw_device', 'gpu']
+
+
+def _get_http_session():
+    """
+    Returns the shared aiohttp session, creating it on first use.
+    """
+    global _AIOHTTP_SESSION
+    if _AIOHTTP_SESSION is None or _AIOHTTP_SESSION.closed:
+        _AIOHTTP_SESSION = aiohttp.ClientSession()
+    return _AIOHTTP_SESSION
+
+async def _run_ffmpeg(output, source=None, slot_reserved=False):
+    """
+    Runs a compiled ffmpeg-python output as an asyncio subprocess so the
+    event loop keeps serving other users during the encode.
+    When source (an async iterator of bytes) is given, it is fed to ffmpeg's stdin.
+    Waits for a job slot unless slot_reserved says the caller already took one;
+    either way the slot is released when ffmpeg is done.
+    Raises ffmpeg.Error on a non-zero exit, like output.run() would.
+    """
+    cmd = output.compile(overwrite_output=True)
+    if not slot_reserved:
+        await _ENCODE_SEM.acquire()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL if source is None else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        async def feed_stdin():
+            try:
+                async for chunk in source:
+                    proc.stdin.write(chunk)
+                    await proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg exited early; its return code and stderr say why
+                pass
+            finally:
+                proc.stdin.close()
+                if hasattr(source, 'aclose'):
+                    await source.aclose()
+
+        # Pump every pipe at once so none of them fills up and stalls ffmpeg
+        pumps = [asyncio.ensure_future(proc.stderr.read())]
+        if source is not None:
+            pumps.append(asyncio.ensure_future(feed_stdin()))
+        try:
+            stderr, *_ = await asyncio.gather(*pumps)
+            await proc.wait()
+        except BaseException:
+            # A failed pump (e.g. the input stream dropping) or a cancelled handler must not
+            # leave ffmpeg or the other pumps running once this job's slot is released
+            for pump in pumps:
+                pump.cancel()
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+            await asyncio.gather(*pumps, return_exceptions=True)
+            # Drain what ffmpeg left in stderr, otherwise the pipe never closes and wait() hangs
+            await proc.stderr.read()
+            await proc.wait()
+            raise
+    finally:
+        _ENCODE_SEM.release()
+    if proc.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', None, stderr)
+
+async def _remove_file(path):
+    """
+    Deletes a temporary file without blocking the event loop; a missing file is not an error.
+    """
+    try:
+        await aiofiles.os.remove(path)
+        logger.debug("Cleaned up temporary file: %s", path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error("Error cleaning up file %s: %s", path, e)
+
+def _job_download_dir(file_size):
+    """
+    Picks where a job keeps its input and encoded output: the scratch directory if it still
+    has room for both (other jobs share it), otherwise the on-disk downloads directory.
+    """
+    if DOWNLOAD_DIR == DISK_DOWNLOAD_DIR or not file_size:
+        return DOWNLOAD_DIR
+    try:
+        if shutil.disk_usage(DOWNLOAD_DIR).free > 2 * file_size:
+            return DOWNLOAD_DIR
+    except OSError:
+        pass
+    return DISK_DOWNLOAD_DIR
+
+@functools.lru_cache(maxsize=64)
+def _png_size(path):
+    """
+    Returns (width, height) of a pre-rendered watermark PNG. Only the header is read.
+    """
+    with Image.open(path) as image:
+        return image.size
+
+def _build_ffmpeg_output(input_url, output_path, image_watermark_path, text_watermark_path, video_size=None):
+    """
+    Builds the ffmpeg-python output for one video, writing an MP4 to output_path.
+    With video_size (width, height), the watermarks are composited on the GPU with
+    overlay_cuda; otherwise they are overlaid on the CPU. Without any watermark the
+    video is only remuxed.
+    """
+    gpu = video_size is not None
+    main_video_input = ffmpeg.input(input_url, **(_GPU_DECODER_ARGS if gpu else _DECODER_ARGS))
+    # Only the first video stream; audio is mapped optionally via the output args
+    video_stream = main_video_input['v:0']
+
+    if not (image_watermark_path or text_watermark_path):
+        # Nothing to burn in, so skip the encode entirely and just remux
+        return ffmpeg.output(video_stream, output_path, **_REMUX_OUTPUT_ARGS)
+
+    if gpu:
+        # NVDEC hands out NV12 surfaces, but overlay_cuda only blends an alpha overlay
+        # (yuva420p) onto a yuv420p main, so convert the main stream on the GPU first
+        video_stream = video_stream.filter('scale_cuda', format='yuv420p')
+
+    def overlay(stream, path, x, y, place):
+        """
+        Overlays the PNG at path. x/y are overlay filter expressions; place(W, H, w, h)
+        computes the same offsets in pixels, since overlay_cuda doesn't take expressions.
+        """
+        watermark = ffmpeg.input(path).video
+        if not gpu:
+            return ffmpeg.filter([stream, watermark], 'overlay', x=x, y=y)
+        x, y = place(*video_size, *_png_size(path))
+        watermark = watermark.filter('format', 'yuva420p').filter('hwupload')
+        return ffmpeg.filter([stream, watermark], 'overlay_cuda', x=x, y=y)
+
+    # 1. Image Watermark (Top Left): 10 pixels from the left and 10 pixels from the top
+    if image_watermark_path:
+        video_stream = overlay(video_stream, image_watermark_path, '10', '10',
+                               lambda W, H, w, h: (10, 10))
+    # 2. Text Watermark (Bottom Center)
+    if text_watermark_path:
+        video_stream = overlay(video_stream, text_watermark_path, '(W-w)/2', 'H-h-10',
+                               lambda W, H, w, h: ((W - w) // 2, H - h - 10))
+
+    if gpu:
+        return ffmpeg.output(
+            video_stream, output_path, **_GPU_ENCODE_OUTPUT_ARGS
+        ).global_args(*_GPU_ENCODE_GLOBAL_ARGS)
+
+    if _VCODEC == 'h264_vaapi':
+        # VAAPI encodes from GPU surfaces, so upload the filtered frames
+        video_stream = video_stream.filter('format', 'nv12').filter('hwupload')
+
+    # Combine processed video stream with original audio stream (if exists).
+    # Re-encode video because filters are applied.
+    return ffmpeg.output(
+        video_stream, output_path, **_ENCODE_OUTPUT_ARGS
+    ).global_args(*_ENCODE_GLOBAL_ARGS)
+
+async def _probe_video_metadata(path, cache_key):
+    """
+    Returns (duration, width, height, comment) for the video at path, memoized on
+    cache_key so re-sent videos don't spawn another ffprobe.
+    """
+    cached = _probe_cache.get(cache_key)
+    if cached is not None:
+        _probe_cache.move_to_end(cache_key)
+        return cached
+
+    # Only the first video stream is needed, so ffprobe can skip describing the rest
+    probe = await asyncio.to_thread(ffmpeg.probe, path, select_streams='v:0')
+    video_info = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
+    metadata = (
+        int(float(probe['format']['duration'])) if 'duration' in probe['format'] else 0,
+        video_info['width'] if video_info else 0,
+        video_info['height'] if video_info else 0,
+        probe['format'].get('tags', {}).get('comment'),
+    )
+    _probe_cache[cache_key] = metadata
+    if len(_probe_cache) > _PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return metadata
+
+async def _send_status(status_message, key, text):
+    """
+    Edits the status message to text unless it already shows it, recording when.
+    """
+    last = _status_edits.get(key)
+    if last is not None and last[0] == text:
+        return
+    _status_edits[key] = (text, time.monotonic())
+    try:
+        await status_message.edit_text(text)
+    except MessageNotModified:
+        pass
+
+async def _flush_status(status_message, key, delay):
+    """
+    Sends the latest deferred edit for a status message once its interval is up.
+    """
+    await asyncio.sleep(delay)
+    text, _ = _status_pending.pop(key)
+    try:
+        await _send_status(status_message, key, text)
+    except Exception as e:
+        logger.warning("Could not update status message. Error: %s", e)
+
+async def _peek_moov(stream):
+    """
+    Reads an MP4 byte stream up to the end of its moov box, if that box comes before
+    the media data and is at most MOOV_PEEK_MAX_SIZE. Returns (head, stream): head is
+    everything read so far, and the returned stream yields it again followed by the rest.
+    """
+    head = bytearray()
+
+    async def fill(size):
+        while len(head) < size:
+            chunk = await anext(stream, None)
+            if chunk is None:
+                return False
+            head.extend(chunk)
+        return True
+
+    # Walk the top-level boxes (ftyp, free, ...) until moov turns up
+    pos = 0
+    while pos <= MOOV_PEEK_MAX_SIZE and await fill(pos + 8):
+        box_size, box_type = struct.unpack_from('>I4s', head, pos)
+        if box_size == 1 and await fill(pos + 16):
+            box_size = struct.unpack_from('>Q', head, pos + 8)[0]
+        if box_type == b'moov':
+            if box_size <= MOOV_PEEK_MAX_SIZE:
+                await fill(pos + box_size)
+            break
+        if box_type == b'mdat' or box_size < 8:
+            break
+        pos += box_size
+
+    async def replay():
+        try:
+            if head:
+                yield bytes(head)
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    return bytes(head), replay()
+
+async def _edit_status(status_message, text, final=False):
+    """
+    Edits a status message, skipping edits that wouldn't change its text. Progress
+    updates within STATUS_EDIT_INTERVAL of the previous edit are deferred, and only
+    the latest one is sent when the interval is up.
+    Pass final=True for end states that must be shown immediately.
+    """
+    key = (status_message.chat.id, status_message.id)
+    pending = _status_pending.get(key)
+    if pending is not None:
+        if not final:
+            # A deferred edit is already scheduled; it will send this newer text instead
+            _status_pending[key] = (text, pending[1])
+            return
+        pending[1].cancel()
+        del _status_pending[key]
+
+    last = _status_edits.get(key)
+    if last is not None and not final:
+        wait = STATUS_EDIT_INTERVAL - (time.monotonic() - last[1])
+        if wait > 0 and last[0] != text:
+            _status_pending[key] = (text, asyncio.ensure_future(_flush_status(status_message, key, wait)))
+            return
+    await _send_status(status_message, key, text)
+
+def _render_text_watermark(text, fontsize):
+    """
+    Rasterizes the text into a tightly cropped RGBA PNG with its opacity baked in,
+    so ffmpeg can overlay it instead of running drawtext on every frame.
+    Returns the PNG path.
+    """
+    text_hash = hashlib.md5(text.encode()).hexdigest()[:12]
+    path = os.path.join(DOWNLOAD_DIR, f"text_watermark_{text_hash}_{fontsize}.png")
+    font = ImageFont.truetype(_FONT_PATH, fontsize)
+    left, top, right, bottom = font.getbbox(text)
+    image = Image.new('RGBA', (right - left, bottom - top), (255, 255, 255, 0))
+    ImageDraw.Draw(image).text((-left, -top), text, font=font,
+                               fill=(255, 255, 255, int(255 * TEXT_WATERMARK_OPACITY)))
+    # Write then rename, so a concurrent encode never reads a half-written file
+    image.save(path + ".tmp", format='PNG')
+    os.replace(path + ".tmp", path)
+    return path
+
+def _text_watermark_font_size(video_height):
+    """
+    Scales the font with the video height, quantized to TEXT_WATERMARK_FONT_SIZE_STEP
+    so only a handful of distinct sizes are ever rendered.
+    """
+    if not video_height:
+        return TEXT_WATERMARK_FONT_SIZE
+    step = TEXT_WATERMARK_FONT_SIZE_STEP
+    scaled = int(video_height * TEXT_WATERMARK_FONT_SCALE)
+    return max(TEXT_WATERMARK_MIN_FONT_SIZE, ((scaled + step - 1) // step) * step)
+
+def _render_image_watermark(width, path):
+    """
+    Scales the downloaded watermark to width and bakes its opacity into the alpha
+    channel, writing an RGBA PNG that ffmpeg can overlay with no further filtering.
+    The file is written under a temporary name and renamed into place, so a crash
+    mid-write never leaves a truncated file that looks valid. Returns path.
+    """
+    tmp_path = path + ".tmp"
+    with Image.open(DEFAULT_IMAGE_WATERMARK_SOURCE_PATH) as source:
+        image = source.convert('RGBA')
+    height = max(1, round(image.height * width / image.width))
+    image = image.resize((width, height), Image.LANCZOS)
+    alpha = image.getchannel('A').point(lambda a: int(a * DEFAULT_IMAGE_WATERMARK_OPACITY))
+    image.putalpha(alpha)
+    try:
+        image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+async def _prepare_default_watermark():
+    """
+    Fetches the default image watermark and pre-renders it once as an RGBA PNG
+    with its size and opacity baked in. Returns True on success.
+    The download is written under a temporary name and renamed into place.
+    """
+    source_tmp_path = DEFAULT_IMAGE_WATERMARK_SOURCE_PATH + ".tmp"
+    try:
+        if not os.path.exists(DEFAULT_IMAGE_WATERMARK_SOURCE_PATH):
+            logger.info("Downloading default image watermark from %s...", DEFAULT_IMAGE_WATERMARK_URL)
+            session = _get_http_session()
+            async with session.get(DEFAULT_IMAGE_WATERMARK_URL) as r:
+                r.raise_for_status()
+                async with aiofiles.open(source_tmp_path, 'wb') as f:
+                    async for chunk in r.content.iter_chunked(65536):
+                        await f.write(chunk)
+            os.replace(source_tmp_path, DEFAULT_IMAGE_WATERMARK_SOURCE_PATH)
+            logger.info("Default image watermark downloaded to %s", DEFAULT_IMAGE_WATERMARK_SOURCE_PATH)
+
+        # Scale and apply opacity here once, so per-video filter graphs only overlay the result
+        await asyncio.to_thread(_render_image_watermark, DEFAULT_IMAGE_WATERMARK_WIDTH, DEFAULT_IMAGE_WATERMARK_PATH)
+        logger.info("Default image watermark pre-rendered to %s", DEFAULT_IMAGE_WATERMARK_PATH)
+        return True
+    except Exception as e:
+        logger.error("Failed to prepare default image watermark from %s. Error: %s", DEFAULT_IMAGE_WATERMARK_URL, e)
+        # Drop leftovers, including a source that couldn't be rendered, so the next attempt starts clean
+        for path in (source_tmp_path, DEFAULT_IMAGE_WATERMARK_SOURCE_PATH):
+            if os.path.exists(path):
+                os.remove(path)
+        # If preparation fails, the image watermark simply won't be applied,
+        # but the bot will continue attempting to process the video with text watermark.
+        return False
+
+async def _get_scaled_watermark(video_width):
+    """
+    Returns the path of an image watermark pre-scaled for video_width. Each width
+    bucket is rendered once and shared; the default render is used as a fallback.
+    Only called once ensure_default_watermarks() reports the watermark available.
+    """
+    if not video_width or not _WM_AVAILABLE:
+        return DEFAULT_IMAGE_WATERMARK_PATH
+
+    bucket = max(1, round(video_width / IMAGE_WATERMARK_WIDTH_BUCKET)) * IMAGE_WATERMARK_WIDTH_BUCKET
+    task = _WM_CACHE.get(bucket)
+    if task is None:
+        width = max(IMAGE_WATERMARK_MIN_WIDTH, int(bucket * IMAGE_WATERMARK_WIDTH_RATIO))
+        task = asyncio.ensure_future(
+            asyncio.to_thread(_render_image_watermark, width, os.path.join(DOWNLOAD_DIR, f"watermark_{bucket}.png"))
+        )
+        _WM_CACHE[bucket] = task
+    try:
+        return await asyncio.shield(task)
+    except Exception as e:
+        logger.warning("Could not pre-scale image watermark for width %s. Error: %s", bucket, e)
+        if _WM_CACHE.get(bucket) is task:
+            del _WM_CACHE[bucket]
+        return DEFAULT_IMAGE_WATERMARK_PATH
+
+async def _get_text_watermark(text, fontsize):
+    """
+    Returns the path of the text watermark rendered at fontsize, or None if it can't be
+    rendered. Each size is rendered once; concurrent callers share the same render.
+    """
+    key = (text, fontsize)
+    task = _TEXT_WM_CACHE.get(key)
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_render_text_watermark, text, fontsize))
+        _TEXT_WM_CACHE[key] = task
+    try:
+        return await asyncio.shield(task)
+    except Exception as e:
+        logger.warning("Could not render text watermark at size %s. Error: %s", fontsize, e)
+        if _TEXT_WM_CACHE.get(key) is task:
+            del _TEXT_WM_CACHE[key]
+        return None
 
 # --- Function to download default watermarks on startup/first use ---
 async def ensure_default_watermarks():
     """
-    Downloads the default image watermark if it doesn't already exist.
-    This prevents repeated downloads and ensures the file is available.
+    Downloads and pre-renders the default image watermark if it doesn't already exist.
+    Concurrent callers share a single preparation instead of each fetching the file.
+    Returns True if the image watermark is available.
     """
-    if not os.path.exists(DEFAULT_IMAGE_WATERMARK_PATH):
-        try:
-            logger.info(f"Downloading default image watermark from {DEFAULT_IMAGE_WATERMARK_URL}...")
-            urllib.request.urlretrieve(DEFAULT_IMAGE_WATERMARK_URL, DEFAULT_IMAGE_WATERMARK_PATH)
-            logger.info(f"Default image watermark downloaded to {DEFAULT_IMAGE_WATERMARK_PATH}")
-        except Exception as e:
-            logger.error(f"Failed to download default image watermark from {DEFAULT_IMAGE_WATERMARK_URL}. Error: {e}")
-            # If download fails, the image watermark simply won't be applied,
-            # but the bot will continue attempting to process the video with text watermark.
-            pass
+    global _WM_AVAILABLE, _default_wm_future
+    if _WM_AVAILABLE:
+        return True
+    if os.path.exists(DEFAULT_IMAGE_WATERMARK_PATH):
+        _WM_AVAILABLE = True
+        return True
+
+    async with _default_wm_lock:
+        if _default_wm_future is None:
+            _default_wm_future = asyncio.ensure_future(_prepare_default_watermark())
+        future = _default_wm_future
+
+    # Shield so one cancelled handler doesn't abort the download for everyone else
+    _WM_AVAILABLE = await asyncio.shield(future)
+    if not _WM_AVAILABLE and _default_wm_future is future:
+        # Let the next caller retry instead of caching the failure
+        _default_wm_future = None
+    return _WM_AVAILABLE
 
 
 # --- Main media handling for videos ---
@@ -47,142 +670,225 @@ async def handle_video_with_watermarks(client, message):
     the processed video.
     """
     user_id = message.from_user.id
-    logger.info(f"Received video from user {user_id} for watermarking.")
+    logger.info("Received video from user %s for watermarking.", user_id)
 
-    # Ensure default watermarks are downloaded before processing
-    await ensure_default_watermarks()
+    # Our own output sent back (e.g. forwarded in a loop) already carries the watermarks
+    if message.video.file_unique_id in _produced_ids:
+        await message.reply_video(video=message.video.file_id, caption="This video is already watermarked.")
+        logger.info("Returned already-watermarked video to user %s.", user_id)
+        return
+
+    # Telegram gives identical content the same file_unique_id, so forwarded copies of a clip
+    # we've already watermarked can be answered by re-sending our earlier upload.
+    cache_key = (message.video.file_unique_id, DEFAULT_TEXT_WATERMARK)
+    cached = _output_cache.get(cache_key)
+    if cached is not None:
+        _output_cache.move_to_end(cache_key)
+        cached_file_id, cached_caption = cached
+        try:
+            await message.reply_video(video=cached_file_id, caption=cached_caption)
+            logger.info("Served cached watermarked video to user %s.", user_id)
+            return
+        except Exception as e:
+            logger.warning("Could not re-send cached watermarked video. Error: %s. Re-encoding.", e)
+            _output_cache.pop(cache_key, None)
 
     input_file_path = None
     output_file_path = None
+    slot_reserved = False # Encode slot taken up front for a piped input, until ffmpeg takes it over
     status_message = None # Initialize status_message for cleanup in finally block
 
     try:
         # Send initial status message
         status_message = await message.reply_text("Downloading video...")
-        
-        # Download the input video
-        input_file_path = await message.download(file_name="./downloads/")
-        if not input_file_path:
-            logger.error(f"Failed to download input video from user {user_id}. Download returned None.")
-            await status_message.edit_text("Failed to download the video.")
+        _status_edits[(status_message.chat.id, status_message.id)] = (status_message.text, time.monotonic())
+
+        # Telegram already reports the size and duration; ffprobe's values are only used when it doesn't.
+        # Watermarking never changes either, so these also describe the output.
+        video = message.video
+        video_duration, video_width, video_height = video.duration, video.width, video.height
+        has_metadata = bool(video_duration and video_width and video_height)
+        job_dir = _job_download_dir(video.file_size)
+
+        # Streamable uploads keep their index at the front, so ffmpeg can read them from a pipe
+        # while they download. A piped download runs at ffmpeg's pace inside an encode slot, so
+        # it's only done when a slot is free right now; a queued job would otherwise hold a
+        # Telegram transfer open. Anything else (or anything that must be probed) is downloaded
+        # first, outside the slot, and a piped encode that fails is retried from a download.
+        input_source = None
+        if video.supports_streaming and has_metadata and not _ENCODE_SEM.locked():
+            # A slot is free, so this doesn't wait; _run_ffmpeg releases it
+            await _ENCODE_SEM.acquire()
+            slot_reserved = True
+            # Ensure default watermarks are downloaded before processing
+            wm_available = await ensure_default_watermarks()
+            stream = client.stream_media(message)
+            moov, input_source = await _peek_moov(stream)
+            input_url = 'pipe:0'
+            base_name = os.path.splitext(video.file_name or video.file_unique_id)[0]
+            # ffprobe needs a file, so look for the sentinel in the buffered moov box instead
+            already_watermarked = WATERMARK_SENTINEL.encode() in moov
+        else:
+            # Download the input video, fetching the default watermarks (first run only) at the same time
+            wm_available, input_file_path = await asyncio.gather(
+                ensure_default_watermarks(),
+                message.download(file_name=os.path.join(job_dir, ""))
+            )
+            if not input_file_path:
+                logger.error("Failed to download input video from user %s. Download returned None.", user_id)
+                await _edit_status(status_message, "Failed to download the video.", final=True)
+                return
+
+            logger.debug("Video downloaded: %s", input_file_path)
+            await _edit_status(status_message, "Downloaded. Applying watermarks...")
+            input_url = input_file_path
+            base_name = os.path.basename(input_file_path).rsplit('.', 1)[0]
+
+            try:
+                probed_duration, probed_width, probed_height, comment = await _probe_video_metadata(
+                    input_file_path, (video.file_unique_id, video.file_size)
+                )
+            except Exception as e:
+                logger.warning("Could not probe video metadata. Error: %s. Using Telegram's values.", e)
+                comment = None
+            else:
+                if not has_metadata:
+                    video_duration, video_width, video_height = probed_duration, probed_width, probed_height
+            already_watermarked = comment == WATERMARK_SENTINEL
+
+        # Produced by this bot before (e.g. before a restart cleared _produced_ids), so don't watermark it twice
+        if already_watermarked:
+            if input_source is not None:
+                await stream.aclose()
+            await message.reply_video(video=video.file_id, caption="This video is already watermarked.")
+            await _edit_status(status_message, "This video is already watermarked.", final=True)
             return
 
-        logger.info(f"Video downloaded: {input_file_path}")
-        await status_message.edit_text("Downloaded. Applying watermarks...")
+        if input_source is not None:
+            await _edit_status(status_message, "Downloading and applying watermarks...")
 
-        # Determine output file path
-        base_name = os.path.basename(input_file_path).rsplit('.', 1)[0]
-        output_file_path = f"./downloads/watermarked_{base_name}.mp4"
+        # Determine the upload file name; ffmpeg writes its output to a temp file in job_dir
+        output_file_name = f"watermarked_{base_name}.mp4"
 
-        # --- FFmpeg Command Construction ---
-        main_video_input = ffmpeg.input(input_file_path)
-        video_stream = main_video_input.video
-        audio_stream = main_video_input.audio # Get audio stream if it exists
-
-        # 1. Image Watermark (Top Left)
-        image_watermark_exists = os.path.exists(DEFAULT_IMAGE_WATERMARK_PATH)
-        if image_watermark_exists:
-            image_watermark_input = ffmpeg.input(DEFAULT_IMAGE_WATERMARK_PATH)
-            
-            # Apply opacity (70%) and then overlay the image.
-            # x='10', y='10' places it 10 pixels from the left and 10 pixels from the top.
-            image_watermark_stream_filtered = image_watermark_input.video.filter('format', 'rgba').filter('colorchannelmixer', aa=0.7)
-            video_stream = ffmpeg.filter([video_stream, image_watermark_stream_filtered], 'overlay',
-                                         x='10', y='10') 
-            logger.info("Image watermark configured for top-left position.")
+        # Watermarks would overflow a tiny frame, so those videos are passed through untouched
+        fits_watermarks = not video_height or video_height >= MIN_WATERMARK_VIDEO_HEIGHT
+        image_watermark_path = None
+        text_watermark_path = None
+
+        # 1. Image Watermark (Top Left), pre-rendered at this size with its opacity
+        if not fits_watermarks:
+            logger.info("Video height %dpx is too small for watermarks. Skipping watermarks.", video_height)
+        elif wm_available:
+            image_watermark_path = await _get_scaled_watermark(video_width)
+            logger.debug("Image watermark configured for top-left position.")
         else:
             logger.warning("Default image watermark file not found. Skipping image watermark.")
 
-        # 2. Text Watermark (Bottom Center)
-        text_watermark_content = DEFAULT_TEXT_WATERMARK
-        text_opacity = 0.8 # 80% opacity for text
-        
-        # Create a dictionary of arguments for the drawtext filter.
-        # ffmpeg-python will correctly format these into the FFmpeg command string.
-        drawtext_args = {
-            'fontfile': '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-            'text': text_watermark_content,
-            'fontcolor': f'white@{text_opacity}', # Use f-string for opacity
-            'fontsize': 24,
-            'x': '(w-text_w)/2',
-            'y': 'H-text_h-10'
-        }
-        
-        # Apply the drawtext filter using keyword arguments from the dictionary
-        video_stream = video_stream.filter('drawtext', **drawtext_args) # <--- THIS IS THE KEY FIX
-        logger.info("Text watermark configured for bottom-center position.")
-
-        # Combine processed video stream with original audio stream
-        # Re-encode video because filters are applied. Copy audio.
-        final_output = ffmpeg.output(
-            video_stream,
-            audio_stream, # Map audio from original input (if exists)
-            output_file_path,
-            vcodec='libx264',    # Video codec for re-encoding
-            acodec='copy',       # Copy audio codec (no re-encoding)
-            preset='medium',     # Encoding speed vs. compression efficiency (ultrafast, superfast, medium, slow, etc.)
-            crf=26,              # Constant Rate Factor for video quality (lower is better quality, larger file size)
-            pix_fmt='yuv420p',   # Pixel format for compatibility (especially with older players)
-            movflags='faststart' # Optimize for web streaming (metadata at beginning)
+        # 2. Text Watermark (Bottom Center), pre-rendered once with its opacity
+        if fits_watermarks and _FONT_PATH:
+            text_watermark_path = await _get_text_watermark(
+                DEFAULT_TEXT_WATERMARK, _text_watermark_font_size(video_height)
+            )
+            logger.debug("Text watermark configured for bottom-center position.")
+        elif fits_watermarks:
+            logger.warning("No watermark font found. Skipping text watermark.")
+
+        # --- FFmpeg Command Construction ---
+        # The GPU compositing path needs the frame size to place the overlays
+        use_gpu = bool(_GPU_OVERLAY and video_width and video_height
+                       and (image_watermark_path or text_watermark_path))
+        # ffmpeg writes the output file itself, so it can add the faststart index at the end
+        fd, output_file_path = tempfile.mkstemp(suffix='.mp4', dir=job_dir)
+        os.close(fd)
+        final_output = _build_ffmpeg_output(
+            input_url, output_file_path, image_watermark_path, text_watermark_path,
+            (video_width, video_height) if use_gpu else None
         )
 
-        logger.info(f"Starting FFmpeg execution for {input_file_path}...")
+        logger.debug("Starting FFmpeg execution for %s...", base_name)
         try:
-            # Run the FFmpeg command.
-            # overwrite_output=True: Allows FFmpeg to overwrite output file if it exists.
-            # quiet=True: Suppresses FFmpeg's verbose output to stdout/stderr.
-            final_output.run(overwrite_output=True, quiet=True)
-            logger.info(f"Watermarks applied successfully. Output: {output_file_path}")
+            # Run the FFmpeg command without blocking the event loop.
+            # Input is streamed from Telegram when streaming; stderr is kept for errors.
+            try:
+                reserved, slot_reserved = slot_reserved, False
+                await _run_ffmpeg(final_output, source=input_source, slot_reserved=reserved)
+            except ffmpeg.Error as e:
+                if not use_gpu and input_source is None:
+                    raise
+                # The GPU graph can't handle every input (e.g. a codec or 10-bit format NVDEC/overlay_cuda
+                # can't decode), and supports_streaming is only the uploader's word that the index is up
+                # front. Either way, redo it once on the CPU from a downloaded copy.
+                logger.warning("FFmpeg failed for %s (GPU: %s, piped: %s), retrying on the CPU from a file. Stderr: %s",
+                               base_name, use_gpu, input_source is not None,
+                               e.stderr.decode(errors='replace')[-500:] if e.stderr else 'N/A')
+                if input_source is not None:
+                    input_source = None
+                    await _edit_status(status_message, "Downloading video again to retry...")
+                    input_file_path = await message.download(file_name=os.path.join(job_dir, ""))
+                    if not input_file_path:
+                        raise
+                    input_url = input_file_path
+                    await _edit_status(status_message, "Downloaded. Applying watermarks...")
+                final_output = _build_ffmpeg_output(input_url, output_file_path, image_watermark_path, text_watermark_path)
+                await _run_ffmpeg(final_output)
+            logger.debug("Watermarks applied successfully. Output: %s", output_file_name)
         except ffmpeg.Error as e:
-            error_message = f"FFmpeg execution failed for {input_file_path}. Stderr: {e.stderr.decode() if e.stderr else 'N/A'}. Error: {str(e)}"
+            error_message = f"FFmpeg execution failed for {base_name}. Stderr: {e.stderr.decode() if e.stderr else 'N/A'}. Error: {str(e)}"
             logger.error(error_message)
-            await status_message.edit_text(f"Error applying watermarks: {error_message}")
+            await _edit_status(status_message, f"Error applying watermarks: {error_message}", final=True)
             return
 
-        await status_message.edit_text("Watermarks applied. Uploading...")
-        logger.info(f"Uploading processed video: {output_file_path}...")
-
-        # Get metadata of the output video for Pyrogram upload parameters
-        try:
-            probe = ffmpeg.probe(output_file_path)
-            output_video_stream = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
-            output_duration = int(float(probe['format']['duration'])) if 'duration' in probe['format'] else 0
-            output_width = output_video_stream['width'] if output_video_stream else 0
-            output_height = output_video_stream['height'] if output_video_stream else 0
-        except Exception as e:
-            logger.warning(f"Could not probe output video for upload metadata. Error: {e}. Using default values.")
-            output_duration, output_width, output_height = 0, 0, 0 # Fallback values
+        await _edit_status(status_message, "Watermarks applied. Uploading...")
+        logger.debug("Uploading processed video: %s...", output_file_name)
 
         # Upload the watermarked video to Telegram
-        await message.reply_video(
+        caption = f"Watermarked by {DEFAULT_TEXT_WATERMARK} - {base_name}"
+        sent_message = await message.reply_video(
             video=output_file_path,
-            caption=f"Watermarked by {DEFAULT_TEXT_WATERMARK} - {base_name}",
-            duration=output_duration,
-            width=output_width,
-            height=output_height,
+            file_name=output_file_name,
+            caption=caption,
+            duration=video_duration,
+            width=video_width,
+            height=video_height,
             supports_streaming=True
         )
+        if sent_message and sent_message.video:
+            # Only a fully watermarked result is reused; one made while a watermark was unavailable
+            # (e.g. the image host was down) is redone next time
+            if image_watermark_path and text_watermark_path:
+                _output_cache[cache_key] = (sent_message.video.file_id, caption)
+                if len(_output_cache) > _OUTPUT_CACHE_SIZE:
+                    _output_cache.popitem(last=False)
+            # A remux-only upload carries no watermark, so it may still be watermarked later
+            if image_watermark_path or text_watermark_path:
+                _produced_ids[sent_message.video.file_unique_id] = None
+                if len(_produced_ids) > _OUTPUT_CACHE_SIZE:
+                    _produced_ids.popitem(last=False)
 
-        logger.info(f"Watermarked video uploaded successfully for user {user_id}.")
-        await status_message.edit_text("Watermarked video uploaded successfully!")
+        logger.info("Watermarked video uploaded successfully for user %s.", user_id)
+        await _edit_status(status_message, "Watermarked video uploaded successfully!", final=True)
 
     except Exception as e:
         # Catch any unexpected errors during the entire process
-        logger.exception(f"An unhandled error occurred during video processing for user {user_id}. Error: {e}")
+        logger.exception("An unhandled error occurred during video processing for user %s. Error: %s", user_id, e)
         if status_message:
-            await status_message.edit_text(f"An unexpected error occurred: {e}")
+            await _edit_status(status_message, f"An unexpected error occurred: {e}", final=True)
         else:
             await message.reply_text(f"An unexpected error occurred: {e}")
     finally:
-        # Ensure all temporary files are cleaned up
+        if slot_reserved:
+            _ENCODE_SEM.release()
+
+        if status_message:
+            key = (status_message.chat.id, status_message.id)
+            _status_edits.pop(key, None)
+            pending = _status_pending.pop(key, None)
+            if pending is not None:
+                pending[1].cancel()
+
+        # Ensure all temporary files are cleaned up, in parallel and without blocking the event loop
         files_to_clean = [input_file_path, output_file_path]
-        for path in files_to_clean:
-            if path and os.path.exists(path):
-                try:
-                    os.remove(path)
-                    logger.info(f"Cleaned up temporary file: {path}")
-                except OSError as e:
-                    logger.error(f"Error cleaning up file {path}: {e}")
+        await asyncio.gather(*map(_remove_file, filter(None, files_to_clean)))
 
 # Register the handler with the Pyrogram client
 def register(app: Client):